@@ -1,47 +1,57 @@
 from __future__ import annotations
 
 import argparse
+import itertools
 import sys
 from pathlib import Path
-from typing import Iterable, List
+from typing import Callable, Iterable, Iterator, List
 
-from marclite.formats import SUPPORTED_FORMATS, detect_format, emit_event, read_records, write_records
+from pymarc import Record
 
+from marclite.formats import (
+    SUPPORTED_FORMATS,
+    ReadStats,
+    detect_format,
+    emit_event,
+    read_batch,
+    stream_records,
+    write_batch,
+    write_records,
+)
 
-def _format_or_detect(path: Path) -> str:
-    return detect_format(path)
 
-
-def cmd_count(args: argparse.Namespace) -> int:
+def cmd_count(args: argparse.Namespace, emit: Callable[[dict], None] = emit_event) -> int:
     input_path = Path(args.input)
-    emit_event({"event": "start", "operation": "count", "input": str(input_path)})
+    emit({"event": "start", "operation": "count", "input": str(input_path)})
+    stats = ReadStats()
     try:
-        result = read_records(input_path)
+        fmt = detect_format(input_path)
+        for _ in stream_records(input_path, fmt, stats):
+            pass
     except Exception as exc:  # noqa: BLE001
-        emit_event({"event": "error", "message": str(exc)})
+        emit({"event": "error", "message": str(exc)})
         return 1
 
-    emit_event(
+    emit(
         {
             "event": "done",
             "operation": "count",
             "input": str(input_path),
-            "format": _format_or_detect(input_path),
-            "records": len(result.records),
-            "dropped": result.dropped,
-            "warnings": result.warnings,
+            "format": fmt,
+            "records": stats.records,
+            "dropped": stats.dropped,
+            "warnings": stats.warnings,
         }
     )
     return 0
 
 
-def cmd_split(args: argparse.Namespace) -> int:
+def cmd_split(args: argparse.Namespace, emit: Callable[[dict], None] = emit_event) -> int:
     input_path = Path(args.input)
     out_dir = Path(args.out_dir)
     every = args.every
-    out_dir.mkdir(parents=True, exist_ok=True)
 
-    emit_event(
+    emit(
         {
             "event": "start",
             "operation": "split",
@@ -51,46 +61,59 @@ def cmd_split(args: argparse.Namespace) -> int:
         }
     )
 
+    if every < 1:
+        emit({"event": "error", "message": f"--every must be at least 1, got {every}"})
+        return 1
+    out_dir.mkdir(parents=True, exist_ok=True)
+
     try:
-        result = read_records(input_path)
+        input_fmt = detect_format(input_path)
     except Exception as exc:  # noqa: BLE001
-        emit_event({"event": "error", "message": str(exc)})
+        emit({"event": "error", "message": str(exc)})
         return 1
-
-    fmt = args.to or _format_or_detect(input_path)
+    fmt = args.to or input_fmt
     if fmt not in SUPPORTED_FORMATS:
-        emit_event({"event": "error", "message": f"Unsupported output format: {fmt}"})
+        emit({"event": "error", "message": f"Unsupported output format: {fmt}"})
         return 1
 
     files_written: List[str] = []
-    total_records = len(result.records)
-    for idx, start in enumerate(range(0, total_records, every), start=1):
-        chunk = result.records[start : start + every]
-        filename = f"{input_path.stem}_part{idx:03d}.{fmt if fmt != 'marcxml' else 'xml'}"
-        out_path = out_dir / filename
-        write_records(chunk, out_path, fmt)
-        files_written.append(str(out_path))
-        emit_event({"event": "progress", "records_read": min(start + len(chunk), total_records)})
-
-    emit_event(
+    stats = ReadStats()
+    records = stream_records(input_path, input_fmt, stats)
+    idx = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(records, every))
+            if not chunk:
+                break
+            idx += 1
+            filename = f"{input_path.stem}_part{idx:03d}.{fmt if fmt != 'marcxml' else 'xml'}"
+            out_path = out_dir / filename
+            write_records(chunk, out_path, fmt)
+            files_written.append(str(out_path))
+            emit({"event": "progress", "records_read": stats.records})
+    except Exception as exc:  # noqa: BLE001
+        emit({"event": "error", "message": str(exc)})
+        return 1
+
+    emit(
         {
             "event": "done",
             "operation": "split",
             "files": files_written,
-            "records": total_records,
-            "dropped": result.dropped,
-            "warnings": result.warnings,
+            "records": stats.records,
+            "dropped": stats.dropped,
+            "warnings": stats.warnings,
         }
     )
     return 0
 
 
-def cmd_merge(args: argparse.Namespace) -> int:
+def cmd_merge(args: argparse.Namespace, emit: Callable[[dict], None] = emit_event) -> int:
     inputs = [Path(p) for p in args.inputs]
     output_path = Path(args.output)
     fmt = args.to
 
-    emit_event(
+    emit(
         {
             "event": "start",
             "operation": "merge",
@@ -100,46 +123,38 @@ def cmd_merge(args: argparse.Namespace) -> int:
         }
     )
 
-    all_records = []
-    warnings: List[str] = []
-    dropped = 0
-
-    for input_path in inputs:
-        try:
-            result = read_records(input_path)
-        except Exception as exc:  # noqa: BLE001
-            emit_event({"event": "error", "message": str(exc)})
-            return 1
-        all_records.extend(result.records)
-        warnings.extend(result.warnings)
-        dropped += result.dropped
-        emit_event({"event": "progress", "records_read": len(all_records)})
+    stats = ReadStats()
+
+    def iter_inputs() -> Iterator[Record]:
+        for input_path in inputs:
+            yield from stream_records(input_path, stats=stats)
+            emit({"event": "progress", "records_read": stats.records})
 
     try:
-        write_records(all_records, output_path, fmt)
+        write_records(iter_inputs(), output_path, fmt)
     except Exception as exc:  # noqa: BLE001
-        emit_event({"event": "error", "message": str(exc)})
+        emit({"event": "error", "message": str(exc)})
         return 1
 
-    emit_event(
+    emit(
         {
             "event": "done",
             "operation": "merge",
             "output": str(output_path),
-            "records": len(all_records),
-            "dropped": dropped,
-            "warnings": warnings,
+            "records": stats.records,
+            "dropped": stats.dropped,
+            "warnings": stats.warnings,
         }
     )
     return 0
 
 
-def cmd_convert(args: argparse.Namespace) -> int:
+def cmd_convert(args: argparse.Namespace, emit: Callable[[dict], None] = emit_event) -> int:
     input_path = Path(args.input)
     output_path = Path(args.output)
     fmt = args.to
 
-    emit_event(
+    emit(
         {
             "event": "start",
             "operation": "convert",
@@ -149,26 +164,27 @@ def cmd_convert(args: argparse.Namespace) -> int:
         }
     )
 
+    stats = ReadStats()
     try:
-        result = read_records(input_path)
-    except Exception as exc:  # noqa: BLE001
-        emit_event({"event": "error", "message": str(exc)})
-        return 1
-
-    try:
-        write_records(result.records, output_path, fmt)
+        input_fmt = detect_format(input_path)
+        batch = read_batch(input_path) if input_fmt == "mrk" and fmt == "mrc" else None
+        if batch is not None:
+            write_batch(batch, output_path)
+            stats.records = len(batch)
+        else:
+            write_records(stream_records(input_path, input_fmt, stats), output_path, fmt)
     except Exception as exc:  # noqa: BLE001
-        emit_event({"event": "error", "message": str(exc)})
+        emit({"event": "error", "message": str(exc)})
         return 1
 
-    emit_event(
+    emit(
         {
             "event": "done",
             "operation": "convert",
             "output": str(output_path),
-            "records": len(result.records),
-            "dropped": result.dropped,
-            "warnings": result.warnings,
+            "records": stats.records,
+            "dropped": stats.dropped,
+            "warnings": stats.warnings,
         }
     )
     return 0
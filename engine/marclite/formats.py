@@ -1,18 +1,68 @@
 from __future__ import annotations
 
+import gc
+import hashlib
 import json
+import mmap
+import os
+import pickle
 import re
-from dataclasses import dataclass
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from functools import lru_cache
+from json.encoder import encode_basestring
 from pathlib import Path
-from typing import Iterable, Iterator, List, Optional
+from stat import S_IMODE, S_ISDIR
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from pymarc import Field, MARCReader, MARCWriter, Record, marcxml
 
-from marclite.mrk import parse_mrk_records, write_mrk_records
+try:
+    from pymarc import Subfield
+except ImportError:  # pymarc < 5 takes flat [code, value, ...] lists
+    Subfield = None
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # pragma: no cover - optional dependency
+    lxml_etree = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+from marclite.mrk import iter_mrk_records, parse_mrk_lines
+
+if TYPE_CHECKING:
+    from marclite.mrk_fastparse import RecordBatch
 
 
 SUPPORTED_FORMATS = {"mrc", "mrk", "marcxml"}
 
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Set to "1" to cache parsed files on disk, keyed by content hash.
+CACHE_ENV = "MARCLITE_CACHE"
+
+_SUFFIX_FORMATS = {".xml": "marcxml", ".mrk": "mrk", ".txt": "mrk", ".mrc": "mrc"}
+
+# Pre-rendered JSON skeletons for the fixed-shape events the CLI emits,
+# keyed by their key order; only the scalar values are encoded per call.
+_EVENT_TEMPLATES: Dict[Tuple[str, ...], str] = {
+    keys: "{" + ",".join(f'"{key}":%s' for key in keys) + "}"
+    for keys in [
+        ("event", "records_read"),
+        ("event", "message"),
+        ("event", "operation", "input"),
+        ("event", "operation", "input", "every", "out_dir"),
+        ("event", "operation", "input", "output", "format"),
+    ]
+}
+
 
 @dataclass
 class ReadResult:
@@ -21,15 +71,33 @@ class ReadResult:
     dropped: int
 
 
+@dataclass
+class ReadStats:
+    records: int = 0
+    warnings: List[str] = field(default_factory=list)
+    dropped: int = 0
+
+
 def detect_format(path: Path) -> str:
-    suffix = path.suffix.lower()
-    if suffix == ".xml":
-        return "marcxml"
-    if suffix in {".mrk", ".txt"}:
-        return "mrk"
-    if suffix == ".mrc":
-        return "mrc"
+    fmt = _SUFFIX_FORMATS.get(path.suffix.lower())
+    if fmt:
+        return fmt
+
+    try:
+        stat = path.stat()
+    except OSError:
+        return _sniff_format(path)
+    # Keyed on the inode rather than a resolved path: symlinks into
+    # /proc/self/fd resolve to names that cannot be opened.
+    return _sniff_format_cached(str(path), stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
 
+
+@lru_cache(maxsize=1024)
+def _sniff_format_cached(path: str, device: int, inode: int, mtime_ns: int, size: int) -> str:
+    return _sniff_format(Path(path))
+
+
+def _sniff_format(path: Path) -> str:
     with path.open("rb") as handle:
         sample = handle.read(2048)
 
@@ -51,46 +119,262 @@ def detect_format(path: Path) -> str:
     raise ValueError(f"Unable to detect MARC format for {path.name}.")
 
 
-def read_records(path: Path, fmt: Optional[str] = None) -> ReadResult:
+def stream_records(path: Path, fmt: Optional[str] = None, stats: Optional[ReadStats] = None) -> Iterator[Record]:
+    """Yield records from ``path`` one at a time, tallying counters into ``stats``.
+
+    With ``MARCLITE_CACHE=1`` each file is served from, or saved to, the disk cache.
+    """
     fmt = fmt or detect_format(path)
-    warnings: List[str] = []
-    records: List[Record] = []
-    dropped = 0
+    if stats is None:
+        stats = ReadStats()
+
+    cache_dir = _private_cache_dir() if os.environ.get(CACHE_ENV) == "1" else None
+    if cache_dir is not None:
+        yield from _stream_records_cached(path, fmt, stats, cache_dir)
+    else:
+        yield from _stream_records(path, fmt, stats)
+
 
+def _stream_records(path: Path, fmt: str, stats: ReadStats) -> Iterator[Record]:
     if fmt == "mrc":
         with path.open("rb") as handle:
+            if hasattr(os, "posix_fadvise"):
+                # Inputs are read once, front to back: ask for aggressive readahead.
+                os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
             reader = MARCReader(handle, to_unicode=True, force_utf8=True, utf8_handling="ignore")
             for idx, record in enumerate(reader, start=1):
-                try:
-                    if record is None:
-                        raise ValueError("Empty record")
-                    records.append(record)
-                except Exception as exc:  # noqa: BLE001
-                    dropped += 1
-                    warnings.append(f"Dropped record {idx}: {exc}")
-        return ReadResult(records, warnings, dropped)
+                if record is None:
+                    stats.dropped += 1
+                    stats.warnings.append(f"Dropped record {idx}: Empty record")
+                    continue
+                stats.records += 1
+                yield record
+        return
 
     if fmt == "marcxml":
-        try:
-            records = marcxml.parse_xml_to_array(str(path))
-        except Exception as exc:  # noqa: BLE001
-            raise ValueError(f"Failed to parse MARCXML: {exc}") from exc
-        return ReadResult(records, warnings, dropped)
+        for record in _iter_marcxml(path):
+            stats.records += 1
+            yield record
+        return
 
     if fmt == "mrk":
-        text = path.read_text(encoding="utf-8", errors="replace")
         try:
-            records = list(parse_mrk_records(text))
+            for record in parse_mrk_lines(_iter_text_lines(_map_file(path))):
+                stats.records += 1
+                yield record
         except ValueError as exc:
             raise ValueError(f"Failed to parse MRK: {exc}") from exc
-        return ReadResult(records, warnings, dropped)
+        return
 
     raise ValueError(f"Unsupported format: {fmt}")
 
 
+def read_records(path: Path, fmt: Optional[str] = None) -> ReadResult:
+    stats = ReadStats()
+    records = list(stream_records(path, fmt, stats))
+    return ReadResult(records, stats.warnings, stats.dropped)
+
+
+def _private_cache_dir() -> Optional[Path]:
+    """Return this user's cache directory, or ``None`` if it cannot be trusted.
+
+    Cached entries are unpickled, so a directory another user could have
+    created or written to must never be read from.
+    """
+    if not hasattr(os, "getuid"):
+        return None
+    cache_dir = Path(tempfile.gettempdir()) / f"marclite-cache-{os.getuid()}"
+    try:
+        cache_dir.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    try:
+        info = os.lstat(cache_dir)
+    except OSError:
+        return None
+    if not S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or S_IMODE(info.st_mode) != 0o700:
+        return None
+    return cache_dir
+
+
+def _stream_records_cached(path: Path, fmt: str, stats: ReadStats, cache_dir: Path) -> Iterator[Record]:
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as handle:
+        while chunk := handle.read(WRITE_BUFFER_SIZE):
+            digest.update(chunk)
+
+    cache_path = cache_dir / f"{digest.hexdigest()}.{fmt}.pkl"
+    # Unpickling allocates one object per field and subfield; pausing the
+    # cyclic GC meanwhile makes loading several times faster.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with cache_path.open("rb") as handle:
+            cached = pickle.load(handle)
+    except Exception:  # noqa: BLE001
+        # Stale pickles can fail with almost anything (AttributeError,
+        # ImportError, ...); any of them just means the entry is rebuilt.
+        cached = None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if isinstance(cached, ReadResult):
+        stats.warnings.extend(cached.warnings)
+        stats.dropped += cached.dropped
+        for record in cached.records:
+            stats.records += 1
+            yield record
+        return
+
+    records: List[Record] = []
+    warnings_start, dropped_start = len(stats.warnings), stats.dropped
+    for record in _stream_records(path, fmt, stats):
+        records.append(record)
+        yield record
+
+    result = ReadResult(records, stats.warnings[warnings_start:], stats.dropped - dropped_start)
+    # Write under a private name first so concurrent readers never see a partial file.
+    partial_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    with partial_path.open("wb") as handle:
+        pickle.dump(result, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(partial_path, cache_path)
+
+
+def read_batch(path: Path) -> Optional[RecordBatch]:
+    """Scan an MRK file into a :class:`RecordBatch`, or ``None`` if it needs ``stream_records``."""
+    # Imported here so only MRK -> MRC conversion pays for loading Numba.
+    from marclite.mrk_fastparse import NUMBA_AVAILABLE, read_mrk_batch
+
+    if not NUMBA_AVAILABLE:
+        return None
+    try:
+        return read_mrk_batch(_map_file(path))
+    except ValueError as exc:
+        raise ValueError(f"Failed to parse MRK: {exc}") from exc
+
+
+def _map_file(path: Path) -> Union[bytes, mmap.mmap]:
+    """Map ``path`` read-only so the OS pages it in on demand instead of copying it."""
+    with path.open("rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return b""
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+
+def _iter_text_lines(data: Union[bytes, mmap.mmap]) -> Iterator[str]:
+    """Yield the lines of UTF-8 ``data``, decoding about a buffer's worth at a time.
+
+    Chunks are cut just after a ``\n``, so no character or ``\r\n`` pair is
+    split and the lines match ``str(data, "utf-8", "replace").splitlines()``.
+    """
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b"\n", min(start + WRITE_BUFFER_SIZE, size) - 1)
+        end = size if end == -1 else end + 1
+        yield from str(data[start:end], "utf-8", errors="replace").splitlines()
+        start = end
+
+
+def _local_name(tag: object) -> str:
+    # lxml reports comments and processing instructions with a non-string tag.
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iter_marcxml(path: Path) -> Iterator[Record]:
+    if lxml_etree is not None:
+        return _iter_marcxml_lxml(path)
+    return _iter_marcxml_etree(path)
+
+
+def _iter_marcxml_lxml(path: Path) -> Iterator[Record]:
+    record_tags = (f"{{{marcxml.MARC_XML_NS}}}record", "record")
+    try:
+        # Uploads are untrusted: never expand external entities or fetch DTDs,
+        # whatever the installed lxml's defaults are.
+        events = lxml_etree.iterparse(
+            str(path),
+            events=("end",),
+            tag=record_tags,
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        )
+        for _, elem in events:
+            record = _element_to_record(elem)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            yield record
+    except lxml_etree.XMLSyntaxError as exc:
+        raise ValueError(f"Failed to parse MARCXML: {exc}") from exc
+
+
+def _iter_marcxml_etree(path: Path) -> Iterator[Record]:
+    root = None
+    try:
+        for event, elem in ET.iterparse(str(path), events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if _local_name(elem.tag) != "record":
+                continue
+            record = _element_to_record(elem)
+            elem.clear()
+            if root is not elem:
+                root.clear()
+            yield record
+    except ET.ParseError as exc:
+        raise ValueError(f"Failed to parse MARCXML: {exc}") from exc
+
+
+def _element_to_record(elem: ET.Element) -> Record:
+    record = Record(force_utf8=True)
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == "leader":
+            record.leader = child.text or ""
+        elif name == "controlfield":
+            record.add_field(Field(tag=child.get("tag", ""), data=child.text or ""))
+        elif name == "datafield":
+            subfields: list = []
+            for subfield in child:
+                if _local_name(subfield.tag) == "subfield":
+                    code, value = subfield.get("code", ""), subfield.text or ""
+                    if Subfield is not None:
+                        subfields.append(Subfield(code, value))
+                    else:
+                        subfields.extend([code, value])
+            record.add_field(
+                Field(
+                    tag=child.get("tag", ""),
+                    indicators=[child.get("ind1", " "), child.get("ind2", " ")],
+                    subfields=subfields,
+                )
+            )
+    return record
+
+
 def write_records(records: Iterable[Record], path: Path, fmt: str) -> None:
+    """Write ``records`` to ``path``; nothing is left there if reading or writing fails."""
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    with _partial_output(path) as partial_path:
+        _write_records(records, partial_path, fmt)
+
+
+def _write_records(records: Iterable[Record], path: Path, fmt: str) -> None:
     if fmt == "mrc":
-        with path.open("wb") as handle:
+        with path.open("wb", buffering=WRITE_BUFFER_SIZE) as handle:
             writer = MARCWriter(handle)
             for record in records:
                 writer.write(record)
@@ -98,7 +382,7 @@ def write_records(records: Iterable[Record], path: Path, fmt: str) -> None:
         return
 
     if fmt == "marcxml":
-        with path.open("wb") as handle:
+        with path.open("wb", buffering=WRITE_BUFFER_SIZE) as handle:
             writer = marcxml.XMLWriter(handle)
             for record in records:
                 writer.write(record)
@@ -106,12 +390,65 @@ def write_records(records: Iterable[Record], path: Path, fmt: str) -> None:
         return
 
     if fmt == "mrk":
-        text = write_mrk_records(records)
-        path.write_text(text, encoding="utf-8")
+        with path.open("w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as handle:
+            for chunk in iter_mrk_records(records):
+                handle.write(chunk)
         return
 
     raise ValueError(f"Unsupported output format: {fmt}")
 
 
+def write_batch(batch: RecordBatch, path: Path) -> None:
+    """Write ``batch`` as ISO 2709 without building pymarc records."""
+    with _partial_output(path) as partial_path, partial_path.open("wb", buffering=WRITE_BUFFER_SIZE) as handle:
+        for marc in batch.iter_marc():
+            handle.write(marc)
+
+
+@contextmanager
+def _partial_output(path: Path) -> Iterator[Path]:
+    # Records are streamed, so a parse error can surface mid-write: build the
+    # output under a private name and only move it into place once complete.
+    partial_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        yield partial_path
+    except BaseException:
+        with suppress(FileNotFoundError):
+            partial_path.unlink()
+        raise
+    os.replace(partial_path, path)
+
+
 def emit_event(payload: dict) -> None:
-    print(json.dumps(payload, ensure_ascii=False))
+    line = encode_event(payload) + b"\n"
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:
+        sys.stdout.write(line.decode("utf-8"))
+    else:
+        buffer.write(line)
+    if payload.get("event") in ("done", "error"):
+        (buffer or sys.stdout).flush()
+
+
+def encode_event(payload: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    encoded = _encode_event_template(payload)
+    if encoded is not None:
+        return encoded
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _encode_event_template(payload: dict) -> Optional[bytes]:
+    template = _EVENT_TEMPLATES.get(tuple(payload))
+    if template is None:
+        return None
+    values = []
+    for value in payload.values():
+        if type(value) is str:
+            values.append(encode_basestring(value))
+        elif type(value) is int:
+            values.append(int.__repr__(value))
+        else:
+            return None
+    return (template % tuple(values)).encode("utf-8")
@@ -1,74 +1,73 @@
 from __future__ import annotations
 
-import re
+import io
 from typing import Iterable, Iterator, List
 
 from pymarc import Field, Record
 
 
-TAG_RE = re.compile(r"^=(?P<tag>\w{3})")
+def _is_word(tag: str) -> bool:
+    # Slow path for tags isalnum() rejects; "_" still counts as a word character.
+    return all(char == "_" or char.isalnum() for char in tag)
 
 
 def parse_mrk_records(text: str) -> Iterator[Record]:
-    blocks: List[List[str]] = []
-    current: List[str] = []
-    for line in text.splitlines():
-        if line.strip() == "":
-            if current:
-                blocks.append(current)
-                current = []
-            continue
-        current.append(line.rstrip("\n"))
-    if current:
-        blocks.append(current)
+    yield from parse_mrk_lines(text.splitlines())
 
-    if not blocks:
-        raise ValueError("No MRK records found.")
 
-    for block in blocks:
+def parse_mrk_lines(lines: Iterable[str]) -> Iterator[Record]:
+    """Like :func:`parse_mrk_records`, for text already split into lines."""
+    found = False
+    for block in _iter_blocks(lines):
+        found = True
         yield parse_mrk_record(block)
 
+    if not found:
+        raise ValueError("No MRK records found.")
+
+
+def _iter_blocks(lines: Iterable[str]) -> Iterator[List[str]]:
+    current: List[str] = []
+    for line in lines:
+        if line and not line.isspace():
+            current.append(line)
+        elif current:
+            yield current
+            current = []
+    if current:
+        yield current
+
 
 def parse_mrk_record(lines: Iterable[str]) -> Record:
     record = Record(force_utf8=True)
+    add_field = record.add_field
+    make_field = Field
     seen_field = False
 
     for line in lines:
-        if not line.startswith("="):
+        if line[:1] != "=":
             raise ValueError(f"Invalid MRK line: {line}")
-        match = TAG_RE.match(line)
-        if not match:
+        tag = line[1:4]
+        if len(tag) != 3 or not (tag.isalnum() or _is_word(tag)):
             raise ValueError(f"Invalid MRK tag: {line}")
-        tag = match.group("tag")
-        rest = line[4:]
-        if rest.startswith(" "):
-            rest = rest[1:]
+        rest = line[5:] if line[4:5] == " " else line[4:]
+        seen_field = True
 
         if tag == "LDR":
             record.leader = rest.strip()
-            seen_field = True
             continue
 
-        if tag.startswith("00"):
-            data = rest.strip()
-            record.add_field(Field(tag=tag, data=data))
-            seen_field = True
+        if tag[0] == "0" and tag[1] == "0":
+            add_field(make_field(tag=tag, data=rest.strip()))
             continue
 
         if len(rest) < 2:
             raise ValueError(f"Missing indicators for tag {tag}")
-        ind1 = rest[0]
-        ind2 = rest[1]
-        subfield_data = rest[2:]
         subfields: List[str] = []
-        for chunk in subfield_data.split("$"):
-            if not chunk:
-                continue
-            code = chunk[0]
-            value = chunk[1:]
-            subfields.extend([code, value])
-        record.add_field(Field(tag=tag, indicators=[ind1, ind2], subfields=subfields))
-        seen_field = True
+        for chunk in rest[2:].split("$"):
+            if chunk:
+                subfields += (chunk[0], chunk[1:])
+        add_field(make_field(tag=tag, indicators=[rest[0], rest[1]], subfields=subfields))
 
     if not seen_field:
         raise ValueError("Record contained no MARC fields.")
@@ -77,18 +76,37 @@ def parse_mrk_record(lines: Iterable[str]) -> Record:
 
 
 def write_mrk_records(records: Iterable[Record]) -> str:
-    output_lines: List[str] = []
+    buffer = io.StringIO()
+    for chunk in iter_mrk_records(records):
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def iter_mrk_records(records: Iterable[Record]) -> Iterator[str]:
+    """Yield MRK text one record at a time; joined, it equals write_mrk_records()."""
+    previous = None
     for record in records:
-        output_lines.append(f"=LDR  {record.leader}")
-        for field in record.fields:
-            if field.is_control_field():
-                output_lines.append(f"={field.tag}  {field.data}")
-                continue
-            ind1 = field.indicators[0] if field.indicators else " "
-            ind2 = field.indicators[1] if len(field.indicators) > 1 else " "
-            subfields = "".join(
-                f"${code}{value}" for code, value in zip(field.subfields[0::2], field.subfields[1::2])
-            )
-            output_lines.append(f"={field.tag}  {ind1}{ind2}{subfields}")
-        output_lines.append("")
-    return "\n".join(output_lines).rstrip() + "\n"
+        text = format_mrk_record(record)
+        if previous is not None:
+            yield previous + "\n\n"
+        previous = text
+    if previous is None:
+        yield "\n"
+    else:
+        yield previous.rstrip() + "\n"
+
+
+def format_mrk_record(record: Record) -> str:
+    output_lines: List[str] = []
+    append = output_lines.append
+    append(f"=LDR  {record.leader}")
+    for field in record.fields:
+        if field.is_control_field():
+            append(f"={field.tag}  {field.data}")
+            continue
+        ind1 = field.indicators[0] if field.indicators else " "
+        ind2 = field.indicators[1] if len(field.indicators) > 1 else " "
+        sf = field.subfields
+        subfields = "".join(["$" + sf[i] + sf[i + 1] for i in range(0, len(sf) - 1, 2)])
+        append(f"={field.tag}  {ind1}{ind2}{subfields}")
+    return "\n".join(output_lines)
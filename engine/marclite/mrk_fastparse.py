@@ -0,0 +1,322 @@
+"""Numba-compiled MRK tokenizer.
+
+The tokenizer walks the raw UTF-8 bytes of an MRK file once and records,
+for every field line, where it starts and ends and where its payload
+begins. Those offsets form a :class:`RecordBatch`, from which pymarc records
+or ISO 2709 bytes are produced. Any input the byte scanner cannot handle
+exactly like :func:`marclite.mrk.parse_mrk_records` (malformed lines, exotic
+line breaks) is handed to that parser instead, so both paths produce the same
+records and the same errors.
+"""
+
+from __future__ import annotations
+
+import codecs
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from pymarc import Field, Record
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+    njit = None
+
+
+NUMBA_AVAILABLE = njit is not None
+
+KIND_DATA = 0
+KIND_CONTROL = 1
+KIND_LEADER = 2
+KIND_FALLBACK = -1
+
+
+def _is_word(c: int) -> bool:
+    return (48 <= c <= 57) or (65 <= c <= 90) or (97 <= c <= 122) or c == 95
+
+
+def _is_space(c: int) -> bool:
+    return c == 32 or (9 <= c <= 13) or (28 <= c <= 31)
+
+
+def _scan_lines(buf):
+    n = buf.shape[0]
+
+    # First pass: size the output arrays and look for line breaks that
+    # str.splitlines() honours but a byte-level "\n" scan would not.
+    nlines = 1
+    fallback = False
+    for i in range(n):
+        c = buf[i]
+        if c == 10:
+            nlines += 1
+        elif c == 11 or c == 12 or c == 28 or c == 29 or c == 30:
+            fallback = True
+        elif c == 13:
+            if i + 1 >= n or buf[i + 1] != 10:
+                fallback = True
+        elif c == 0xC2:
+            if i + 1 < n and buf[i + 1] == 0x85:
+                fallback = True
+        elif c == 0xE2:
+            if i + 2 < n and buf[i + 1] == 0x80 and (buf[i + 2] == 0xA8 or buf[i + 2] == 0xA9):
+                fallback = True
+
+    line_start = np.empty(nlines, np.int64)
+    line_end = np.empty(nlines, np.int64)
+    line_rest = np.empty(nlines, np.int64)
+    line_record = np.empty(nlines, np.int64)
+    line_kind = np.empty(nlines, np.int8)
+
+    count = 0
+    record = 0
+    in_record = False
+    pos = 0
+    while not fallback:
+        end = pos
+        while end < n and buf[end] != 10:
+            end += 1
+        stop = end
+        if stop > pos and buf[stop - 1] == 13:
+            stop -= 1
+
+        blank = True
+        for j in range(pos, stop):
+            if not _is_space(buf[j]):
+                blank = False
+                break
+
+        if blank:
+            if in_record:
+                record += 1
+                in_record = False
+        else:
+            in_record = True
+            kind = KIND_FALLBACK
+            rest = pos + 4
+            if stop - pos >= 4 and buf[pos] == 61:
+                if _is_word(buf[pos + 1]) and _is_word(buf[pos + 2]) and _is_word(buf[pos + 3]):
+                    if rest < stop and buf[rest] == 32:
+                        rest += 1
+                    if buf[pos + 1] == 76 and buf[pos + 2] == 68 and buf[pos + 3] == 82:
+                        kind = KIND_LEADER
+                    elif buf[pos + 1] == 48 and buf[pos + 2] == 48:
+                        kind = KIND_CONTROL
+                    elif stop - rest >= 2 and buf[rest] < 128 and buf[rest + 1] < 128:
+                        kind = KIND_DATA
+
+            line_start[count] = pos
+            line_end[count] = stop
+            line_rest[count] = rest
+            line_record[count] = record
+            line_kind[count] = kind
+            count += 1
+            if kind == KIND_FALLBACK:
+                fallback = True
+
+        if end >= n:
+            break
+        pos = end + 1
+
+    return (
+        fallback,
+        count,
+        line_start,
+        line_end,
+        line_rest,
+        line_record,
+        line_kind,
+    )
+
+
+if NUMBA_AVAILABLE:
+    _is_word = njit(cache=True)(_is_word)
+    _is_space = njit(cache=True)(_is_space)
+    _scan_lines = njit(cache=True)(_scan_lines)
+
+
+@dataclass
+class RecordBatch:
+    """Field lines of a scanned MRK file, stored as parallel arrays.
+
+    Every array has one entry per field line (``LDR`` included) and indexes
+    into ``data``. ``record_starts`` holds the first line of each record.
+    """
+
+    data: bytes
+    line_start: np.ndarray
+    line_end: np.ndarray
+    line_rest: np.ndarray
+    line_kind: np.ndarray
+    record_starts: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.record_starts)
+
+    def _tag_bytes(self) -> np.ndarray:
+        buf = np.frombuffer(self.data, dtype=np.uint8)
+        return buf[self.line_start[:, None] + np.arange(1, 4)]
+
+    def _needs_pymarc(self) -> bool:
+        # pymarc renames tags such as "1_0" (int() accepts the underscore) and
+        # does not treat "00X" as a control field; leave those to it.
+        tag = self._tag_bytes()
+        if (tag == 95).any():
+            return True
+        digits = ((tag >= 48) & (tag <= 57)).all(axis=1)
+        if not digits[self.line_kind == KIND_CONTROL].all():
+            return True
+        return not _is_valid_utf8(self.data)
+
+    def _iter_lines(self) -> Iterator[Tuple[int, int, int, int, int]]:
+        """Yield ``(record_index, start, rest, end, kind)`` for every line."""
+        bounds = self.record_starts.tolist() + [len(self.line_start)]
+        starts = self.line_start.tolist()
+        rests = self.line_rest.tolist()
+        ends = self.line_end.tolist()
+        kinds = self.line_kind.tolist()
+        for index in range(len(bounds) - 1):
+            for i in range(bounds[index], bounds[index + 1]):
+                yield index, starts[i], rests[i], ends[i], kinds[i]
+
+    def iter_records(self) -> Iterator[Record]:
+        data = self.data
+        record = None
+        current = -1
+        for index, start, rest, end, kind in self._iter_lines():
+            if index != current:
+                if record is not None:
+                    yield record
+                record = Record(force_utf8=True)
+                current = index
+
+            tag = data[start + 1 : start + 4].decode("ascii")
+
+            if kind == KIND_LEADER:
+                record.leader = data[rest:end].decode("utf-8", errors="replace").strip()
+                continue
+
+            if kind == KIND_CONTROL:
+                value = data[rest:end].decode("utf-8", errors="replace").strip()
+                record.add_field(Field(tag=tag, data=value))
+                continue
+
+            subfields: List[str] = []
+            for chunk in data[rest + 2 : end].split(b"$"):
+                if chunk:
+                    text = chunk.decode("utf-8", errors="replace")
+                    subfields += (text[0], text[1:])
+            record.add_field(
+                Field(tag=tag, indicators=[chr(data[rest]), chr(data[rest + 1])], subfields=subfields)
+            )
+
+        if record is not None:
+            yield record
+
+    def iter_marc(self) -> Iterator[bytes]:
+        """Yield each record as ISO 2709 bytes, matching pymarc's ``Record.as_marc()``."""
+        if self._needs_pymarc():
+            for record in self.iter_records():
+                yield record.as_marc()
+            return
+
+        data = self.data
+        leader = _DEFAULT_LEADER
+        directory: List[bytes] = []
+        fields: List[bytes] = []
+        offset = 0
+        current = 0
+        for index, start, rest, end, kind in self._iter_lines():
+            if index != current:
+                yield _assemble_marc(leader, directory, fields)
+                leader = _DEFAULT_LEADER
+                directory = []
+                fields = []
+                offset = 0
+                current = index
+
+            if kind == KIND_LEADER:
+                leader = data[rest:end].decode("utf-8").strip()
+                continue
+
+            if kind == KIND_CONTROL:
+                field = data[rest:end].decode("utf-8").strip().encode("utf-8") + b"\x1e"
+            else:
+                chunks = [chunk for chunk in data[rest + 2 : end].split(b"$") if chunk]
+                separator = b"\x1f" if chunks else b""
+                field = data[rest : rest + 2] + separator + b"\x1f".join(chunks) + b"\x1e"
+            directory.append(data[start + 1 : start + 4] + b"%04d%05d" % (len(field), offset))
+            fields.append(field)
+            offset += len(field)
+
+        if len(self):
+            yield _assemble_marc(leader, directory, fields)
+
+
+_DEFAULT_LEADER = Record(force_utf8=True).leader
+
+
+def _assemble_marc(leader: str, directory: List[bytes], fields: List[bytes]) -> bytes:
+    if len(leader) < 10:
+        # as_marc() reads leader[9] to pick the encoding and fails the same way.
+        raise IndexError("string index out of range")
+    directory_bytes = b"".join(directory) + b"\x1e"
+    field_bytes = b"".join(fields) + b"\x1d"
+    base_address = 24 + len(directory_bytes)
+    header = "%05d%s%05d%s" % (
+        base_address + len(field_bytes),
+        leader[5:12],
+        base_address,
+        leader[17:],
+    )
+    return header.encode("utf-8") + directory_bytes + field_bytes
+
+
+def _is_valid_utf8(data: bytes) -> bool:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    view = memoryview(data)
+    try:
+        for offset in range(0, len(data), 1 << 20):
+            decoder.decode(view[offset : offset + (1 << 20)])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def read_mrk_batch(data: bytes) -> Optional[RecordBatch]:
+    """Scan ``data`` into a :class:`RecordBatch`.
+
+    Returns ``None`` when Numba is unavailable or the input needs the
+    pure-Python parser; callers should then use :func:`marclite.mrk.parse_mrk_records`.
+    """
+    if not NUMBA_AVAILABLE:
+        return None
+
+    (
+        fallback,
+        count,
+        line_start,
+        line_end,
+        line_rest,
+        line_record,
+        line_kind,
+    ) = _scan_lines(np.frombuffer(data, dtype=np.uint8))
+
+    if fallback:
+        return None
+    if count == 0:
+        raise ValueError("No MRK records found.")
+
+    line_record = line_record[:count]
+    record_starts = np.concatenate(([0], np.flatnonzero(np.diff(line_record)) + 1))
+    return RecordBatch(
+        data=data,
+        line_start=line_start[:count],
+        line_end=line_end[:count],
+        line_rest=line_rest[:count],
+        line_kind=line_kind[:count],
+        record_starts=record_starts,
+    )
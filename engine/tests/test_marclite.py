@@ -1,10 +1,26 @@
 from __future__ import annotations
 
+import argparse
+import json
+import os
+import pickle
+import tempfile
 from pathlib import Path
 
+import pytest
 from pymarc import Field, Record
 
-from marclite.formats import detect_format, read_records, write_records
+from marclite import cli, formats
+from marclite.formats import (
+    ReadStats,
+    detect_format,
+    encode_event,
+    read_records,
+    stream_records,
+    write_records,
+)
+from marclite.mrk import parse_mrk_records
+from marclite.mrk_fastparse import read_mrk_batch
 
 FIXTURES = Path(__file__).parent / "fixtures"
 
@@ -31,6 +47,16 @@ def test_detect_formats(tmp_path: Path) -> None:
     assert detect_format(mrc_path) == "mrc"
 
 
+@pytest.mark.skipif(not Path("/proc/self/fd").is_dir(), reason="needs /proc/self/fd")
+def test_detect_format_through_fd_symlink(tmp_path: Path) -> None:
+    with tempfile.TemporaryFile() as handle:
+        handle.write((FIXTURES / "tiny.mrk").read_bytes())
+        handle.flush()
+        link = tmp_path / "upload"
+        link.symlink_to(f"/proc/self/fd/{handle.fileno()}")
+        assert detect_format(link) == "mrk"
+
+
 def test_count_records(tmp_path: Path) -> None:
     mrc_path = make_mrc(tmp_path)
     result = read_records(mrc_path)
@@ -66,3 +92,157 @@ def test_convert_outputs(tmp_path: Path) -> None:
 
     assert read_records(out_xml).records
     assert read_records(out_mrc).records
+
+
+def test_stream_records_tracks_stats() -> None:
+    stats = ReadStats()
+    records = stream_records(FIXTURES / "tiny.xml", stats=stats)
+    first = next(records)
+    assert first["001"].data == "0001"
+    assert stats.records == 1
+    assert sum(1 for _ in records) == 1
+    assert stats.records == 2
+    assert stats.dropped == 0
+
+
+def test_mrk_fastparse_matches_pure_parser() -> None:
+    data = (FIXTURES / "tiny.mrk").read_bytes()
+    batch = read_mrk_batch(data)
+    if batch is None:
+        pytest.skip("Numba is not installed")
+    fast = [record.as_marc() for record in batch.iter_records()]
+    pure = [record.as_marc() for record in parse_mrk_records(data.decode("utf-8"))]
+    assert fast == pure
+    assert len(fast) == 2
+
+
+def test_record_batch_serializes_like_pymarc() -> None:
+    data = (FIXTURES / "tiny.mrk").read_bytes()
+    batch = read_mrk_batch(data)
+    if batch is None:
+        pytest.skip("Numba is not installed")
+    pure = list(parse_mrk_records(data.decode("utf-8")))
+    assert list(batch.iter_marc()) == [record.as_marc() for record in pure]
+
+
+def test_read_records_uses_disk_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    mrk_path = tmp_path / "tiny.mrk"
+    mrk_path.write_bytes((FIXTURES / "tiny.mrk").read_bytes())
+    monkeypatch.setenv("MARCLITE_CACHE", "1")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path / "cache"))
+    (tmp_path / "cache").mkdir()
+
+    first = read_records(mrk_path)
+    mrk_path.rename(tmp_path / "renamed.mrk")
+    second = read_records(tmp_path / "renamed.mrk")
+
+    assert len(list((tmp_path / "cache").glob("marclite-cache-*/*.mrk.pkl"))) == 1
+    assert [r.as_marc() for r in second.records] == [r.as_marc() for r in first.records]
+
+
+def test_read_records_skips_untrusted_cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MARCLITE_CACHE", "1")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    cache_dir = tmp_path / f"marclite-cache-{os.getuid()}"
+    cache_dir.mkdir(mode=0o755)
+    cache_dir.chmod(0o755)
+
+    result = read_records(FIXTURES / "tiny.mrk")
+
+    assert len(result.records) == 2
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_event_templates_match_json_dumps(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(formats, "orjson", None)
+    payloads = [
+        {"event": "progress", "records_read": 42},
+        {"event": "error", "message": 'Bad "tag"\tin caf\u00e9\x01'},
+        {"event": "start", "operation": "convert", "input": "in.mrk", "output": "out.mrc", "format": "mrc"},
+    ]
+    for payload in payloads:
+        expected = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        assert encode_event(payload) == expected
+    assert encode_event({"event": "progress", "records_read": None}) == b'{"event":"progress","records_read":null}'
+
+
+def test_split_command_writes_partial_last_chunk(tmp_path: Path) -> None:
+    mrc_path = make_mrc(tmp_path)
+    merged = tmp_path / "three.mrc"
+    records = read_records(mrc_path).records
+    write_records(records + records[:1], merged, "mrc")
+    out_dir = tmp_path / "parts"
+
+    assert cli.main(["split", "--every", "2", str(merged), "--out-dir", str(out_dir)]) == 0
+
+    parts = sorted(out_dir.iterdir())
+    assert [p.name for p in parts] == ["three_part001.mrc", "three_part002.mrc"]
+    assert [len(read_records(p).records) for p in parts] == [2, 1]
+
+
+def test_marcxml_does_not_resolve_external_entities(tmp_path: Path) -> None:
+    secret = tmp_path / "secret.txt"
+    secret.write_text("top-secret")
+    xml_path = tmp_path / "entity.xml"
+    xml_path.write_text(
+        f'<?xml version="1.0"?>\n<!DOCTYPE collection [<!ENTITY x SYSTEM "file://{secret}">]>\n'
+        '<collection xmlns="http://www.loc.gov/MARC21/slim"><record>'
+        '<leader>00000nam a2200000 a 4500</leader><controlfield tag="001">&x;</controlfield>'
+        "</record></collection>"
+    )
+
+    try:
+        records = list(stream_records(xml_path))
+    except ValueError:
+        return
+    assert all("top-secret" not in (field.data or "") for record in records for field in record.fields)
+
+
+def test_split_command_rejects_non_positive_every(tmp_path: Path) -> None:
+    mrc_path = make_mrc(tmp_path)
+    out_dir = tmp_path / "parts"
+
+    assert cli.main(["split", "--every", "0", str(mrc_path), "--out-dir", str(out_dir)]) == 1
+    assert not out_dir.exists()
+
+
+@pytest.mark.parametrize("fmt", ["mrk", "mrc"])
+def test_convert_leaves_no_output_on_parse_error(tmp_path: Path, fmt: str) -> None:
+    bad_path = tmp_path / "bad.mrk"
+    bad_path.write_text((FIXTURES / "tiny.mrk").read_text() + "\n\nnot a field\n")
+    out_path = tmp_path / f"out.{fmt}"
+
+    assert cli.main(["convert", str(bad_path), "-o", str(out_path), "--to", fmt]) == 1
+    assert list(tmp_path.iterdir()) == [bad_path]
+
+
+def test_count_command_uses_disk_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MARCLITE_CACHE", "1")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    events: list = []
+
+    assert cli.cmd_count(argparse.Namespace(input=str(FIXTURES / "tiny.mrk")), events.append) == 0
+    assert cli.cmd_count(argparse.Namespace(input=str(FIXTURES / "tiny.mrk")), events.append) == 0
+
+    assert len(list(tmp_path.glob("marclite-cache-*/*.mrk.pkl"))) == 1
+    assert [event["records"] for event in events if event["event"] == "done"] == [2, 2]
+
+
+def test_read_records_rebuilds_stale_cache_entry(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MARCLITE_CACHE", "1")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    read_records(FIXTURES / "tiny.mrk")
+    (cache_path,) = tmp_path.glob("marclite-cache-*/*.mrk.pkl")
+    cache_path.write_bytes(b"cmarclite.formats\nNoLongerDefined\n.")
+
+    result = read_records(FIXTURES / "tiny.mrk")
+
+    assert len(result.records) == 2
+    assert isinstance(pickle.loads(cache_path.read_bytes()), formats.ReadResult)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 20])
+def test_iter_text_lines_matches_splitlines(monkeypatch: pytest.MonkeyPatch, chunk_size: int) -> None:
+    monkeypatch.setattr(formats, "WRITE_BUFFER_SIZE", chunk_size)
+    data = "=LDR  x\r\n=001  café\r\r\n\n \n=245  10$a\U0001d538\x85b \n".encode("utf-8") + b"\xff\xc3\n\n"
+    assert list(formats._iter_text_lines(data)) == str(data, "utf-8", errors="replace").splitlines()
@@ -1,18 +1,151 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
-import json
+import contextlib
+import hashlib
+import io
+import os
+import re
+import secrets
 import shutil
-import subprocess
 import tempfile
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import AsyncIterator
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Optional
 
+import aiofiles
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from marclite import cli, formats
 
-app = FastAPI(title="marclite", description="HTTP wrapper for marclite CLI")
+# While the app's lifespan runs, per-request directories live under one root
+# and finished ones are removed in batches by the janitor task. Without it
+# (e.g. ``--lifespan off``) each request gets its own temp dir, removed inline.
+TEMP_ROOT: Optional[Path] = None
+
+JANITOR_INTERVAL = 5.0
+
+_discarded: Deque[Path] = deque()
+
+
+def make_request_dir(operation: str) -> Path:
+    if TEMP_ROOT is None:
+        return Path(tempfile.mkdtemp(prefix=f"marclite_{operation}_", dir="/tmp"))
+    path = TEMP_ROOT / f"{operation}_{secrets.token_hex(8)}"
+    path.mkdir()
+    return path
+
+
+def discard_dir(path: Path) -> None:
+    """Queue ``path`` for removal by the janitor, or remove it now if none runs.
+
+    Safe to call from any thread.
+    """
+    if TEMP_ROOT is None:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    _discarded.append(path)
+
+
+async def discard_dir_after_response(path: Path) -> None:
+    # Starlette sends sync background callables through its thread pool;
+    # appending to the janitor's deque is safe to do right on the loop.
+    discard_dir(path)
+
+
+def _sweep_discarded() -> None:
+    while _discarded:
+        shutil.rmtree(_discarded.popleft(), ignore_errors=True)
+
+
+async def janitor() -> None:
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL)
+        await asyncio.to_thread(_sweep_discarded)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    global TEMP_ROOT, RESULT_CACHE_DIR
+    TEMP_ROOT = Path(tempfile.mkdtemp(prefix="marclite_root_", dir="/tmp"))
+    RESULT_CACHE_DIR = TEMP_ROOT / "results"
+    task = asyncio.create_task(janitor())
+    try:
+        yield
+    finally:
+        task.cancel()
+        root, TEMP_ROOT, RESULT_CACHE_DIR = TEMP_ROOT, None, None
+        _discarded.clear()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+app = FastAPI(title="marclite", description="HTTP wrapper for marclite CLI", lifespan=lifespan)
+
+CommandFunc = Callable[[argparse.Namespace, Callable[[dict], None]], int]
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+STREAM_CHUNK_SIZE = 64 << 10
+
+# In UTF-8 bytes, leaving room under NAME_MAX for prefixes and output suffixes.
+MAX_UPLOAD_STEM = 64
+
+MAX_UPLOAD_SUFFIX = 16
+
+MERGE_SPILL_CONCURRENCY = 8
+
+# Byte budget for reusing convert/merge outputs of identical uploads. Off by
+# default: every miss pays an extra read of the uploads to hash them.
+RESULT_CACHE_BYTES = int(os.environ.get("MARCLITE_RESULT_CACHE_BYTES", 0))
+
+# Lives under TEMP_ROOT, so the cache is only used while the lifespan runs.
+RESULT_CACHE_DIR: Optional[Path] = None
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MARCLITE_MAX_UPLOAD_BYTES", 2 << 30))
+
+# Commands run on their own thread pool, so long conversions never occupy the
+# default executor that hashing, the janitor and aiofiles rely on. The threads
+# share one GIL: extra slots only overlap file I/O and the parts of lxml and
+# Numba that release it, so further requests wait their turn.
+COMMAND_THREADS = min(32, (os.cpu_count() or 1) * 2)
+
+COMMAND_SLOTS = asyncio.Semaphore(COMMAND_THREADS)
+
+COMMAND_EXECUTOR = ThreadPoolExecutor(max_workers=COMMAND_THREADS, thread_name_prefix="marclite-command")
+
+
+class UploadSizeLimit:
+    """ASGI middleware rejecting oversize requests from Content-Length, before the body is spooled."""
+
+    def __init__(self, app, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name != b"content-length":
+                    continue
+                try:
+                    too_large = int(value) > self.max_bytes
+                except ValueError:
+                    response = JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})
+                    return await response(scope, receive, send)
+                if too_large:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"detail": f"Upload exceeds {self.max_bytes} bytes"}
+                    )
+                    return await response(scope, receive, send)
+                break
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimit, max_bytes=MAX_UPLOAD_BYTES)
 
 
 @app.get("/health")
@@ -20,63 +153,230 @@ async def health():
     return {"status": "healthy"}
 
 
-async def stream_cli_output(process: asyncio.subprocess.Process) -> AsyncIterator[str]:
-    """Stream CLI output line by line, converting to JSONL format."""
-    if process.stdout is None:
+def upload_name(filename: Optional[str]) -> str:
+    """Return a safe, short on-disk name for an upload.
+
+    Directory parts and leading dots are dropped and unusual characters
+    replaced, so client names cannot escape the request directory. The suffix
+    is kept because format detection and output names rely on it. Both parts
+    are capped in UTF-8 bytes, since that is what NAME_MAX limits.
+    """
+    name = Path((filename or "").replace("\\", "/")).name.lstrip(".")
+    stem, suffix = os.path.splitext(name)
+    stem = _truncate_utf8(re.sub(r"[^\w.-]", "_", stem), MAX_UPLOAD_STEM) or "upload"
+    return stem + _truncate_utf8(re.sub(r"[^\w.]", "_", suffix), MAX_UPLOAD_SUFFIX)
+
+
+def _truncate_utf8(text: str, limit: int) -> str:
+    return text.encode("utf-8")[:limit].decode("utf-8", "ignore")
+
+
+async def save_upload(upload: UploadFile, dest: Path) -> None:
+    """Copy an upload to disk in fixed-size chunks instead of reading it whole."""
+    async with aiofiles.open(dest, "wb") as handle:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await handle.write(chunk)
+
+
+async def link_upload(upload: UploadFile, dest: Path) -> None:
+    """Expose an upload's spooled temp file at ``dest`` without copying it.
+
+    Starlette has already written the request body to a temp file; a symlink
+    through ``/proc/self/fd`` lets marclite read it in place. The file stays
+    open until the response has been sent. Falls back to ``save_upload`` where
+    ``/proc`` is unavailable.
+    """
+    # fileno() rolls small in-memory uploads over to a real temp file.
+    fd_path = Path(f"/proc/self/fd/{upload.file.fileno()}")
+    if not fd_path.exists():
+        await save_upload(upload, dest)
         return
+    dest.symlink_to(fd_path)
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable sink that a ZipFile writes into and the response drains."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(paths: Iterable[Path]) -> Iterator[bytes]:
+    """Yield a zip archive of ``paths`` piece by piece, without writing it to disk.
+
+    MARC binary compresses poorly and is stored as-is; MARCXML parts are
+    deflated at the fastest level.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as zipf:
+        for file_path in paths:
+            info = zipfile.ZipInfo.from_file(file_path, arcname=file_path.name)
+            if file_path.suffix == ".xml":
+                info.compress_type = zipfile.ZIP_DEFLATED
+                # ZipFile.open() ignores the archive's compresslevel for a
+                # caller-supplied ZipInfo; the attribute is public from 3.13.
+                if hasattr(info, "compress_level"):
+                    info.compress_level = 1
+                else:
+                    info._compresslevel = 1
+            else:
+                info.compress_type = zipfile.ZIP_STORED
+            with file_path.open("rb") as src, zipf.open(info, "w") as dest:
+                while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                    dest.write(chunk)
+                    if data := sink.drain():
+                        yield data
+    yield sink.drain()
+
+
+def hash_uploads(uploads: List[UploadFile], *key: str) -> str:
+    """Hash the uploads' contents, in order, together with ``key``."""
+    digest = hashlib.blake2b("\0".join(key).encode("utf-8"), digest_size=16)
+    for upload in uploads:
+        file_digest = hashlib.blake2b(digest_size=16)
+        upload.file.seek(0)
+        while chunk := upload.file.read(UPLOAD_CHUNK_SIZE):
+            file_digest.update(chunk)
+        upload.file.seek(0)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+
+def load_cached_result(key: str, dest: Path) -> bool:
+    """Hard-link the cached output for ``key`` to ``dest``; False on a miss."""
+    cached = RESULT_CACHE_DIR / key
+    try:
+        os.link(cached, dest)
+        os.utime(cached)
+    except FileNotFoundError:
+        return False
+    return True
 
-    while True:
-        line = await process.stdout.readline()
-        if not line:
-            break
 
-        text = line.decode("utf-8").rstrip()
-        if not text:
-            continue
+def store_cached_result(key: str, output_path: Path) -> None:
+    """Keep ``output_path`` for reuse, evicting least recently used outputs over budget.
 
+    Blocking and may run in several threads at once; call it via ``asyncio.to_thread``.
+    """
+    if output_path.stat().st_size > RESULT_CACHE_BYTES:
+        return
+    RESULT_CACHE_DIR.mkdir(exist_ok=True)
+    partial_path = RESULT_CACHE_DIR / f"{key}.{secrets.token_hex(4)}.tmp"
+    os.link(output_path, partial_path)
+    os.replace(partial_path, RESULT_CACHE_DIR / key)
+
+    entries = []
+    for entry in os.scandir(RESULT_CACHE_DIR):
+        if entry.name.endswith(".tmp"):
+            continue
         try:
-            json.loads(text)
-            yield f"{text}\n"
-        except json.JSONDecodeError:
-            wrapped = json.dumps({"event": "log", "message": text})
-            yield f"{wrapped}\n"
+            stat_result = entry.stat()
+        except FileNotFoundError:  # evicted by a concurrent store
+            continue
+        entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RESULT_CACHE_BYTES:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        total -= size
+
+
+def encode_event(payload: dict) -> bytes:
+    # Same encoder as the CLI: orjson when installed, else pre-rendered templates.
+    return formats.encode_event(payload) + b"\n"
 
-    await process.wait()
 
-    if process.returncode != 0:
-        stderr_output = ""
-        if process.stderr:
-            stderr_bytes = await process.stderr.read()
-            stderr_output = stderr_bytes.decode("utf-8", errors="replace")[:1000]
+async def stream_command_output(func: CommandFunc, args: argparse.Namespace) -> AsyncIterator[bytes]:
+    """Run a marclite command on the command pool, streaming its events as JSONL."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
 
-        error_event = json.dumps({
-            "event": "error",
-            "message": f"CLI exited with code {process.returncode}",
-            "stderr": stderr_output
-        })
-        yield f"{error_event}\n"
+    def emit(payload: dict) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, encode_event(payload))
+
+    await COMMAND_SLOTS.acquire()
+    task = loop.run_in_executor(COMMAND_EXECUTOR, func, args, emit)
+    task.add_done_callback(lambda _: COMMAND_SLOTS.release())
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    # Coalesce whatever events are already queued into one chunk of up to
+    # STREAM_CHUNK_SIZE bytes, so bursts cost one send() rather than one per line.
+    done = False
+    while not done:
+        line = await queue.get()
+        if line is None:
+            break
+        chunk = [line]
+        size = len(line)
+        while size < STREAM_CHUNK_SIZE and not queue.empty():
+            line = queue.get_nowait()
+            if line is None:
+                done = True
+                break
+            chunk.append(line)
+            size += len(line)
+        yield b"".join(chunk)
+
+    if task.exception() is not None:
+        yield encode_event({"event": "error", "message": str(task.exception())})
+
+
+async def run_command(func: CommandFunc, args: argparse.Namespace) -> dict:
+    """Run a marclite command on the command pool, raising HTTPException on failure.
+
+    Returns the command's ``done`` event.
+    """
+    errors: list[str] = []
+    done: dict = {}
+
+    def emit(payload: dict) -> None:
+        if payload.get("event") == "error":
+            errors.append(str(payload.get("message", "")))
+        elif payload.get("event") == "done":
+            done.update(payload)
+
+    loop = asyncio.get_running_loop()
+    async with COMMAND_SLOTS:
+        returncode = await loop.run_in_executor(COMMAND_EXECUTOR, func, args, emit)
+    if returncode != 0:
+        raise HTTPException(
+            status_code=500,
+            detail=f"marclite {args.command} failed: {'; '.join(errors)}"
+        )
+    return done
 
 
 @app.post("/count")
 async def count(input_file: UploadFile = File(...)):
     """Count records in a MARC file. Returns JSONL stream."""
-    temp_dir = Path(tempfile.mkdtemp(prefix="marclite_count_", dir="/tmp"))
+    temp_dir = make_request_dir("count")
 
     try:
-        input_path = temp_dir / input_file.filename
-        content = await input_file.read()
-        input_path.write_bytes(content)
-
-        process = await asyncio.create_subprocess_exec(
-            "marclite", "count", str(input_path),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        input_path = temp_dir / upload_name(input_file.filename)
+        await link_upload(input_file, input_path)
+
+        args = argparse.Namespace(command="count", input=str(input_path))
 
         async def cleanup_after_stream():
-            async for chunk in stream_cli_output(process):
-                yield chunk
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            try:
+                async for chunk in stream_command_output(cli.cmd_count, args):
+                    yield chunk
+            finally:
+                discard_dir(temp_dir)
 
         return StreamingResponse(
             cleanup_after_stream(),
@@ -84,66 +384,102 @@ async def count(input_file: UploadFile = File(...)):
         )
 
     except Exception as exc:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        discard_dir(temp_dir)
         raise HTTPException(status_code=500, detail=str(exc))
 
 
-@app.post("/convert")
-async def convert(
-    input_file: UploadFile = File(...),
-    to: str = Form(...)
-):
-    """Convert MARC file to specified format. Returns converted file."""
-    temp_dir = Path(tempfile.mkdtemp(prefix="marclite_convert_", dir="/tmp"))
+async def convert_upload(
+    input_file: UploadFile,
+    to: str,
+    operation: str,
+    headers_from_done: Optional[Callable[[dict], Dict[str, str]]] = None,
+) -> FileResponse:
+    """Convert ``input_file`` and respond with the output file.
 
-    try:
-        input_path = temp_dir / input_file.filename
-        content = await input_file.read()
-        input_path.write_bytes(content)
+    ``headers_from_done`` maps the command's ``done`` event to extra response
+    headers; such requests bypass the result cache, since a hit has no event.
+    """
+    temp_dir = make_request_dir(operation)
 
+    try:
+        input_path = temp_dir / upload_name(input_file.filename)
         ext = "xml" if to == "marcxml" else to
         output_filename = f"{input_path.stem}_converted.{ext}"
         output_path = temp_dir / output_filename
 
-        process = await asyncio.create_subprocess_exec(
-            "marclite", "convert", str(input_path),
-            "-o", str(output_path),
-            "--to", to,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        cache_key = None
+        if RESULT_CACHE_BYTES and RESULT_CACHE_DIR is not None and headers_from_done is None:
+            # The suffix takes part in format detection, so it is part of the key.
+            cache_key = await asyncio.to_thread(
+                hash_uploads, [input_file], "convert", to, input_path.suffix
+            )
+        headers: Dict[str, str] = {}
+        if cache_key is None or not load_cached_result(cache_key, output_path):
+            await link_upload(input_file, input_path)
 
-        await process.wait()
-
-        if process.returncode != 0:
-            stderr_output = ""
-            if process.stderr:
-                stderr_bytes = await process.stderr.read()
-                stderr_output = stderr_bytes.decode("utf-8", errors="replace")[:1000]
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"CLI exited with code {process.returncode}: {stderr_output}"
+            args = argparse.Namespace(
+                command="convert", input=str(input_path), output=str(output_path), to=to
             )
+            done = await run_command(cli.cmd_convert, args)
+            if headers_from_done is not None:
+                headers = headers_from_done(done)
 
-        if not output_path.exists():
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            if cache_key is not None and output_path.exists():
+                await asyncio.to_thread(store_cached_result, cache_key, output_path)
+
+        try:
+            stat_result = output_path.stat()
+        except FileNotFoundError:
             raise HTTPException(status_code=500, detail="Output file was not created")
 
+        # Passing the stat result sets Content-Length up front and spares
+        # FileResponse its own stat() in a worker thread.
         return FileResponse(
             path=str(output_path),
             filename=output_filename,
             media_type="application/octet-stream",
-            background=lambda: shutil.rmtree(temp_dir, ignore_errors=True)
+            stat_result=stat_result,
+            headers=headers,
+            background=BackgroundTask(discard_dir_after_response, temp_dir)
         )
 
     except HTTPException:
+        discard_dir(temp_dir)
         raise
     except Exception as exc:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        discard_dir(temp_dir)
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.post("/convert")
+async def convert(
+    input_file: UploadFile = File(...),
+    to: str = Form(...)
+):
+    """Convert MARC file to specified format. Returns converted file."""
+    return await convert_upload(input_file, to, "convert")
+
+
+def count_headers(done: dict) -> Dict[str, str]:
+    return {
+        "X-Record-Count": str(done.get("records", 0)),
+        "X-Dropped-Count": str(done.get("dropped", 0)),
+    }
+
+
+@app.post("/convert_with_count")
+async def convert_with_count(
+    input_file: UploadFile = File(...),
+    to: str = Form(...)
+):
+    """Convert MARC file and count its records in one pass.
+
+    Returns the converted file, with the counts in ``X-Record-Count`` and
+    ``X-Dropped-Count`` headers.
+    """
+    return await convert_upload(input_file, to, "convert_with_count", headers_from_done=count_headers)
+
+
 @app.post("/split")
 async def split(
     input_file: UploadFile = File(...),
@@ -151,62 +487,39 @@ async def split(
     to: str = Form(None)
 ):
     """Split MARC file into chunks. Returns zip of output files."""
-    temp_dir = Path(tempfile.mkdtemp(prefix="marclite_split_", dir="/tmp"))
+    temp_dir = make_request_dir("split")
 
     try:
-        input_path = temp_dir / input_file.filename
-        content = await input_file.read()
-        input_path.write_bytes(content)
+        input_path = temp_dir / upload_name(input_file.filename)
+        await link_upload(input_file, input_path)
 
         out_dir = temp_dir / "output"
         out_dir.mkdir()
 
-        cmd = [
-            "marclite", "split",
-            "--every", str(every),
-            str(input_path),
-            "--out-dir", str(out_dir)
-        ]
-
-        if to:
-            cmd.extend(["--to", to])
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        args = argparse.Namespace(
+            command="split", input=str(input_path), every=every, out_dir=str(out_dir), to=to
         )
+        await run_command(cli.cmd_split, args)
 
-        await process.wait()
-
-        if process.returncode != 0:
-            stderr_output = ""
-            if process.stderr:
-                stderr_bytes = await process.stderr.read()
-                stderr_output = stderr_bytes.decode("utf-8", errors="replace")[:1000]
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"CLI exited with code {process.returncode}: {stderr_output}"
-            )
+        parts = sorted(path for path in out_dir.iterdir() if path.is_file())
 
-        zip_path = temp_dir / "split_output.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in out_dir.iterdir():
-                if file_path.is_file():
-                    zipf.write(file_path, arcname=file_path.name)
+        def cleanup_after_stream():
+            try:
+                yield from iter_zip(parts)
+            finally:
+                discard_dir(temp_dir)
 
-        return FileResponse(
-            path=str(zip_path),
-            filename="split_output.zip",
+        return StreamingResponse(
+            cleanup_after_stream(),
             media_type="application/zip",
-            background=lambda: shutil.rmtree(temp_dir, ignore_errors=True)
+            headers={"Content-Disposition": 'attachment; filename="split_output.zip"'}
         )
 
     except HTTPException:
+        discard_dir(temp_dir)
         raise
     except Exception as exc:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        discard_dir(temp_dir)
         raise HTTPException(status_code=500, detail=str(exc))
 
 
@@ -216,59 +529,54 @@ async def merge(
     to: str = Form(...)
 ):
     """Merge multiple MARC files into one. Returns merged file."""
-    temp_dir = Path(tempfile.mkdtemp(prefix="marclite_merge_", dir="/tmp"))
+    temp_dir = make_request_dir("merge")
 
     try:
-        input_paths = []
-        for idx, upload_file in enumerate(files):
-            input_path = temp_dir / f"input_{idx}_{upload_file.filename}"
-            content = await upload_file.read()
-            input_path.write_bytes(content)
-            input_paths.append(str(input_path))
-
+        input_paths = [
+            str(temp_dir / f"input_{idx}_{upload_name(upload_file.filename)}")
+            for idx, upload_file in enumerate(files)
+        ]
         ext = "xml" if to == "marcxml" else to
         output_filename = f"merged.{ext}"
         output_path = temp_dir / output_filename
 
-        cmd = [
-            "marclite", "merge",
-            *input_paths,
-            "-o", str(output_path),
-            "--to", to
-        ]
+        cache_key = None
+        if RESULT_CACHE_BYTES and RESULT_CACHE_DIR is not None:
+            suffixes = [Path(path).suffix for path in input_paths]
+            cache_key = await asyncio.to_thread(hash_uploads, files, "merge", to, *suffixes)
+        if cache_key is None or not load_cached_result(cache_key, output_path):
+            spill_slots = asyncio.Semaphore(MERGE_SPILL_CONCURRENCY)
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+            async def spill(upload_file: UploadFile, input_path: str) -> None:
+                async with spill_slots:
+                    await link_upload(upload_file, Path(input_path))
 
-        await process.wait()
-
-        if process.returncode != 0:
-            stderr_output = ""
-            if process.stderr:
-                stderr_bytes = await process.stderr.read()
-                stderr_output = stderr_bytes.decode("utf-8", errors="replace")[:1000]
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"CLI exited with code {process.returncode}: {stderr_output}"
+            await asyncio.gather(*(spill(f, path) for f, path in zip(files, input_paths)))
+
+            args = argparse.Namespace(
+                command="merge", inputs=input_paths, output=str(output_path), to=to
             )
+            await run_command(cli.cmd_merge, args)
+
+            if cache_key is not None and output_path.exists():
+                await asyncio.to_thread(store_cached_result, cache_key, output_path)
 
-        if not output_path.exists():
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        try:
+            stat_result = output_path.stat()
+        except FileNotFoundError:
             raise HTTPException(status_code=500, detail="Output file was not created")
 
         return FileResponse(
             path=str(output_path),
             filename=output_filename,
             media_type="application/octet-stream",
-            background=lambda: shutil.rmtree(temp_dir, ignore_errors=True)
+            stat_result=stat_result,
+            background=BackgroundTask(discard_dir_after_response, temp_dir)
         )
 
     except HTTPException:
+        discard_dir(temp_dir)
         raise
     except Exception as exc:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        discard_dir(temp_dir)
         raise HTTPException(status_code=500, detail=str(exc))
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+from pymarc import MARCReader
+from starlette.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+from app import UploadSizeLimit, upload_name  # noqa: E402
+
+TINY_MRK = (Path(__file__).resolve().parents[2] / "engine" / "tests" / "fixtures" / "tiny.mrk").read_bytes()
+
+
+@pytest.fixture
+def client():
+    with TestClient(app.app) as client:
+        yield client
+
+
+def control_numbers(data: bytes) -> list:
+    return [record["001"].data for record in MARCReader(io.BytesIO(data))]
+
+
+def test_upload_name_drops_directories():
+    assert upload_name("../../etc/passwd") == "passwd"
+    assert upload_name("..\\..\\records.mrc") == "records.mrc"
+
+
+def test_upload_name_strips_leading_dots():
+    assert upload_name(".bashrc") == "bashrc"
+    assert upload_name("...") == "upload"
+
+
+def test_upload_name_defaults_when_empty():
+    assert upload_name(None) == "upload"
+    assert upload_name("") == "upload"
+    assert upload_name(".mrk") == "mrk"
+
+
+def test_upload_name_caps_long_unicode_names_in_bytes():
+    name = upload_name("\U0001d538" * 100 + ".mrk")
+    assert name.endswith(".mrk")
+    assert len(name.encode("utf-8")) <= app.MAX_UPLOAD_STEM + len(".mrk")
+    assert len(f"input_99_{Path(name).stem}_converted.xml".encode("utf-8")) < 255
+
+
+def test_result_cache_hit_miss_and_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "RESULT_CACHE_DIR", tmp_path / "results")
+    monkeypatch.setattr(app, "RESULT_CACHE_BYTES", 10)
+    assert not app.load_cached_result("a", tmp_path / "miss")
+
+    outputs = {}
+    for key, mtime in (("a", 1), ("b", 2)):
+        outputs[key] = tmp_path / f"{key}.mrc"
+        outputs[key].write_bytes(b"x" * 4)
+        app.store_cached_result(key, outputs[key])
+        os.utime(app.RESULT_CACHE_DIR / key, (mtime, mtime))
+    assert app.load_cached_result("a", tmp_path / "hit")
+    assert (tmp_path / "hit").read_bytes() == b"xxxx"
+
+    # "a" was just used, so "b" is the least recent and goes over budget.
+    outputs["c"] = tmp_path / "c.mrc"
+    outputs["c"].write_bytes(b"y" * 4)
+    app.store_cached_result("c", outputs["c"])
+    assert sorted(os.listdir(app.RESULT_CACHE_DIR)) == ["a", "c"]
+
+    # Outputs larger than the whole budget are never kept.
+    big = tmp_path / "big.mrc"
+    big.write_bytes(b"z" * 11)
+    app.store_cached_result("big", big)
+    assert not app.load_cached_result("big", tmp_path / "big-hit")
+
+
+def test_count_streams_jsonl_events(client):
+    with client.stream("POST", "/count", files={"input_file": ("tiny.mrk", TINY_MRK)}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    assert [event["event"] for event in events] == ["start", "done"]
+    assert (events[-1]["format"], events[-1]["records"], events[-1]["dropped"]) == ("mrk", 2, 0)
+
+
+def test_split_returns_stored_zip_parts(client):
+    response = client.post(
+        "/split", data={"every": "1", "to": "mrc"}, files={"input_file": ("tiny.mrk", TINY_MRK)}
+    )
+
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        infos = archive.infolist()
+        assert [info.filename for info in infos] == ["tiny_part001.mrc", "tiny_part002.mrc"]
+        assert {info.compress_type for info in infos} == {zipfile.ZIP_STORED}
+        assert [control_numbers(archive.read(info)) for info in infos] == [["0001"], ["0002"]]
+
+
+def test_merge_keeps_upload_order(client):
+    third = b"=LDR  00000nam a2200000 a 4500\n=001  0003\n=245  10$aThird record\n"
+    response = client.post(
+        "/merge",
+        data={"to": "mrc"},
+        files=[("files", ("third.mrk", third)), ("files", ("tiny.mrk", TINY_MRK))],
+    )
+
+    assert response.status_code == 200
+    assert control_numbers(response.content) == ["0003", "0001", "0002"]
+
+
+def test_convert_with_count_sets_count_headers(client):
+    response = client.post(
+        "/convert_with_count", data={"to": "mrc"}, files={"input_file": ("tiny.mrk", TINY_MRK)}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["x-record-count"] == "2"
+    assert response.headers["x-dropped-count"] == "0"
+    assert control_numbers(response.content) == ["0001", "0002"]
+
+
+def test_upload_size_limit_rejects_large_requests():
+    with TestClient(UploadSizeLimit(app.app, max_bytes=64)) as client:
+        response = client.post("/count", files={"input_file": ("tiny.mrk", TINY_MRK)})
+
+    assert response.status_code == 413